@@ -1,78 +1,305 @@
 import cv2
 import numpy as np
+import os
 import threading
 import time
-from typing import List, Optional
-from capture_server import run_server
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from capture_server import run_server, set_fusion_state
+
+try:
+    import numexpr
+except ImportError:  # plain NumPy products and normalization
+    numexpr = None
+
+
+def _make_pow(exponent):
+    """
+    x ** exponent, specialized for the exponents used in practice:
+    np.power with a float exponent goes through a transcendental pow() per element.
+    """
+    if exponent == 1.0:
+        return lambda x: x
+    if exponent == 2.0:
+        return np.square
+    return lambda x: np.power(x, exponent)
+
+
+def _weight_expression(wc, ws, we) -> str:
+    """numexpr source for one weight map, with unit exponents left out like _make_pow."""
+    terms = [name if e == 1.0 else f"{name}**{float(e)!r}"
+             for name, e in (("contrast", wc), ("saturation", ws), ("exposedness", we))]
+    return " * ".join(terms) + " + epsilon"
 
 
 class ExposureFusionEngine:
+    # Shared by all cameras' engines: brackets are fused in parallel, and the pyrDown/
+    # pyrUp/multiply calls doing the work release the GIL.
+    _pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='fusion')
+
     def __init__(self, contrast_weight=1.0, saturation_weight=1.0, exposure_weight=1.0):
         self.wc, self.ws, self.we = contrast_weight, saturation_weight, exposure_weight
+        self._pow_c, self._pow_s, self._pow_e = _make_pow(self.wc), _make_pow(self.ws), _make_pow(self.we)
+        self._weight_expr = _weight_expression(self.wc, self.ws, self.we)
+        self._scratch: Dict[tuple, dict] = {}
+        self._plan: Dict[tuple, tuple] = {}
 
+    # Contrast and saturation are taken on the uint8 image and scaled afterwards:
+    # integer inputs are exact in float32, so flat/grey pixels come out as exactly 0
+    # (as they did in float64) instead of ~1e-8 rounding noise that outweighs epsilon.
     def _compute_contrast(self, gray_img):
-        return np.abs(cv2.Laplacian(gray_img, cv2.CV_64F))
+        # abs and scale in the Laplacian's own buffer: no float temporaries
+        lap = cv2.Laplacian(gray_img, cv2.CV_32F)
+        np.abs(lap, out=lap)
+        lap *= np.float32(1 / 255.0)
+        return lap
 
     def _compute_saturation(self, img):
-        return np.std(img, axis=2)
+        return np.std(img, axis=2, dtype=np.float32) * (1 / 255.0)
 
     def _compute_exposedness(self, img):
         sigma = 0.2
-        gauss_curve = np.exp(-0.5 * np.power(img - 0.5, 2) / np.power(sigma, 2))
-        return np.prod(gauss_curve, axis=2)
+        # prod_c exp(x_c) == exp(sum_c x_c): sum the exponents in one HxW buffer, one exp
+        d = img - 0.5
+        e = np.square(d[..., 0])
+        for c in range(1, d.shape[2]):
+            e += np.square(d[..., c])
+        e *= -0.5 / (sigma * sigma)
+        np.exp(e, out=e)
+        return e
 
     def _generate_weight_maps(self, images):
-        weights = []
+        """Normalized weights as one (N, H, W) float32 array; weights[i] belongs to images[i]."""
+        weights = np.empty((len(images),) + images[0].shape[:2], np.float32)
+        # The brackets are independent: compute them as one batch on the shared pool
+        list(self._pool.map(self._bracket_weight, images, weights))
+        return self._normalize_weights(weights)
+
+    def _bracket_weight(self, img, out):
+        """Unnormalized weight map of one bracket, written into out (HxW float32)."""
         epsilon = 1e-12
-        for img in images:
-            img_norm = img / 255.0
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) / 255.0
-            contrast = self._compute_contrast(gray)
-            saturation = self._compute_saturation(img_norm)
-            exposedness = self._compute_exposedness(img_norm)
-            weights.append(np.power(contrast, self.wc) * np.power(saturation, self.ws) * np.power(exposedness, self.we) + epsilon)
-        sum_weights = np.sum(weights, axis=0)
-        return [w / sum_weights for w in weights]
-
-    def _gaussian_pyramid(self, img, levels):
-        pyr = [img]
-        for _ in range(levels - 1): pyr.append(cv2.pyrDown(pyr[-1]))
-        return pyr
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # float32 throughout: the pipeline is bandwidth-bound, half the bytes of float64
+        img_norm = img.astype(np.float32) * (1 / 255.0)
+        contrast = self._compute_contrast(gray)
+        saturation = self._compute_saturation(img)
+        exposedness = self._compute_exposedness(img_norm)
+        if numexpr is not None:
+            # One blocked, multithreaded pass instead of a NumPy temporary per operator
+            numexpr.evaluate(self._weight_expr, local_dict={
+                'contrast': contrast, 'saturation': saturation, 'exposedness': exposedness,
+                'epsilon': np.float32(epsilon)}, out=out)
+        else:
+            np.multiply(self._pow_c(contrast), self._pow_s(saturation), out=out)
+            out *= self._pow_e(exposedness)
+            out += epsilon
 
-    def _laplacian_pyramid(self, img, levels):
-        gauss_pyr = self._gaussian_pyramid(img, levels)
-        lap_pyr = []
-        for i in range(levels - 1):
-            h, w = gauss_pyr[i].shape[:2]
-            upsampled = cv2.pyrUp(gauss_pyr[i+1], dstsize=(w, h))
-            lap_pyr.append(gauss_pyr[i] - upsampled)
-        lap_pyr.append(gauss_pyr[-1])
-        return lap_pyr
-
-    def _reconstruct(self, pyramid):
+    def _normalize_weights(self, weights):
+        """Divide (N, H, W) weights in place so they sum to 1 at every pixel."""
+        total = weights.sum(axis=0)
+        if numexpr is not None:
+            numexpr.evaluate("weights / total", out=weights)
+        else:
+            weights /= total
+        return weights
+
+    def _reconstruct(self, pyramid, up_out):
+        """
+        Collapses the pyramid in place: each level is overwritten with the running sum,
+        up_out[i] holds the upsampled level i + 1 (same shape as pyramid[i]).
+        """
         img = pyramid[-1]
         for i in range(len(pyramid) - 2, -1, -1):
             h, w = pyramid[i].shape[:2]
-            img = cv2.pyrUp(img, dstsize=(w, h)) + pyramid[i]
+            up = cv2.pyrUp(img, dst=up_out[i], dstsize=(w, h))
+            img = cv2.add(up, pyramid[i], dst=pyramid[i])
         return img
 
+    def _get_plan(self, shape):
+        """
+        (num_levels, level_shapes) for an input shape. pyrDown halves each side
+        rounding up, so the level shapes follow from the input shape alone.
+        """
+        plan = self._plan.get(shape)
+        if plan is None:
+            # At least one level (the image itself); below 8 px the formula gives 0 or less
+            num_levels = max(int(np.log2(min(shape[:2]))) - 2, 1)
+            h, w = shape[:2]
+            level_shapes = []
+            for _ in range(num_levels):
+                level_shapes.append((h, w) + tuple(shape[2:]))
+                h, w = (h + 1) // 2, (w + 1) // 2
+            plan = self._plan[shape] = (num_levels, level_shapes)
+        return plan
+
+    def _get_scratch(self, shape, count):
+        """
+        Float32 work buffers for one input shape, allocated on first use and reused by
+        every later fuse() call (same camera, same resolution) instead of re-allocating
+        dozens of large arrays per capture cycle. Each of the `count` brackets gets its
+        own set so they can be processed concurrently.
+        """
+        _, levels = self._get_plan(shape)
+        scratch = self._scratch.get(shape)
+        if scratch is None:
+            scratch = self._scratch[shape] = {
+                'accum': [np.empty(s, np.float32) for s in levels],
+                'brackets': [],
+            }
+        brackets = scratch['brackets']
+        while len(brackets) < count:
+            brackets.append({
+                'img': np.empty(shape, np.float32),
+                'gauss': [np.empty(s, np.float32) for s in levels[1:]],
+                'lap': [np.empty(s, np.float32) for s in levels[:-1]],
+                'weight': [np.empty(s[:2], np.float32) for s in levels[1:]],
+            })
+        return scratch
+
+    def _process_bracket(self, image, weight, num_levels, buffers):
+        """
+        Weighted Laplacian pyramid of one bracket, built in that bracket's buffers:
+        level i is gauss(weight)[i] * laplacian(image)[i].
+
+        One downward pass: each level's image and weight Gaussians, its Laplacian and
+        its weighting are done together while that level is still in cache.
+        """
+        g_img = np.multiply(image, np.float32(1 / 255.0), out=buffers['img'])
+        g_w = weight
+        pyr = []
+        for level in range(num_levels - 1):
+            next_img = cv2.pyrDown(g_img, dst=buffers['gauss'][level])
+            next_w = cv2.pyrDown(g_w, dst=buffers['weight'][level])
+            h, w = g_img.shape[:2]
+            # Upsample into the level's buffer, then subtract in place: lap = g - up
+            lap = cv2.pyrUp(next_img, dst=buffers['lap'][level], dstsize=(w, h))
+            cv2.subtract(g_img, lap, dst=lap)
+            # Broadcast the HxW weight over the channels instead of building a HxWx3 copy
+            np.multiply(g_w[..., None], lap, out=lap)
+            pyr.append(lap)
+            g_img, g_w = next_img, next_w
+        # The top level is the image Gaussian itself; its buffer is no longer needed
+        np.multiply(g_w[..., None], g_img, out=g_img)
+        pyr.append(g_img)
+        return pyr
+
     def fuse(self, images: List[np.ndarray]) -> Optional[np.ndarray]:
         if not images: return None
         shape = images[0].shape
         weights = self._generate_weight_maps(images)
-        min_dim = min(shape[:2])
-        num_levels = int(np.log2(min_dim)) - 2
-        pyr_fusion = [np.zeros_like(img, dtype=np.float64) for img in self._gaussian_pyramid(images[0], num_levels)]
-
-        for i in range(len(images)):
-            img_float = images[i].astype(np.float64) / 255.0
-            pyr_img = self._laplacian_pyramid(img_float, num_levels)
-            pyr_weight = self._gaussian_pyramid(weights[i], num_levels)
-            for level in range(num_levels):
-                w_expanded = cv2.cvtColor(pyr_weight[level].astype(np.float32), cv2.COLOR_GRAY2BGR)
-                pyr_fusion[level] += w_expanded * pyr_img[level]
-        
-        return (np.clip(self._reconstruct(pyr_fusion), 0, 1) * 255).astype(np.uint8)
+        num_levels, _ = self._get_plan(shape)
+        scratch = self._get_scratch(shape, len(images))
+        brackets = scratch['brackets']
+        pyramids = list(self._pool.map(
+            self._process_bracket, images, weights,
+            [num_levels] * len(images), brackets[:len(images)]))
+
+        # Reduce the weighted pyramids into the accumulator
+        pyr_fusion = scratch['accum']
+        for level in range(num_levels):
+            np.copyto(pyr_fusion[level], pyramids[0][level])
+            for pyr in pyramids[1:]:
+                pyr_fusion[level] += pyr[level]
+
+        # The bracket buffers are free now; reconstruct and clip in place
+        result = self._reconstruct(pyr_fusion, brackets[0]['lap'])
+        np.clip(result, 0, 1, out=result)
+        result *= 255
+        return result.astype(np.uint8)  # a fresh array: callers keep it after the next fuse()
+
+
+def _frame_brightness(frame: np.ndarray) -> float:
+    """
+    Mean over all pixels and channels (same value as np.mean), via OpenCV's SIMD cv2.mean.
+    """
+    channels = frame.shape[2] if frame.ndim == 3 else 1
+    return sum(cv2.mean(frame)[:channels]) / channels
+
+
+def set_latest_frame(cam_config: dict, ret, frame) -> None:
+    """
+    Publish a new preview frame. The server keys its encoded-JPEG cache
+    (and the ETag) on 'latest_frame_id', so it must change with every frame.
+    """
+    cam_config['latest_frame_data'] = (ret, frame)
+    cam_config['latest_frame_id'] = cam_config.get('latest_frame_id', 0) + 1
+    cond = cam_config.get('frame_cond')
+    if cond is not None:
+        with cond:
+            cond.notify_all()  # wake /api/stream clients
+
+
+class FrameGrabber:
+    """
+    Reads a VideoCapture on its own thread at the camera's rate and keeps only the
+    newest frame, so the driver queue never backs up with stale frames while the
+    worker is busy. VideoCapture isn't thread-safe: property changes are queued
+    and applied by the reader thread between two reads.
+    """
+
+    def __init__(self, cap: cv2.VideoCapture, on_frame=None):
+        self._cap = cap
+        self._on_frame = on_frame  # called on the reader thread with every new frame
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._frame: Optional[np.ndarray] = None
+        self._settings: List[tuple] = []
+        self._applied = 0  # number of set() requests applied so far
+        self._requested = 0
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while self._running:
+            with self._cond:
+                pending, self._settings = self._settings, []
+            for prop, value in pending:
+                self._cap.set(prop, value)
+            if pending:
+                with self._cond:
+                    self._applied += len(pending)
+                    self._cond.notify_all()
+
+            ret, frame = self._cap.read()
+            if not ret:
+                time.sleep(0.1)
+                continue
+            if self._on_frame is not None:
+                self._on_frame(frame)
+            with self._cond:
+                self._seq += 1
+                self._frame = frame
+                self._cond.notify_all()
+
+    def set(self, prop: int, value) -> int:
+        """
+        cap.set(prop, value) on the reader thread. Blocks until applied and returns the
+        current sequence number: read() with it returns a frame read after the change.
+        """
+        with self._cond:
+            self._settings.append((prop, value))
+            self._requested += 1
+            target = self._requested
+            self._cond.wait_for(lambda: self._applied >= target or not self._running)
+            return self._seq
+
+    def read(self, after_seq: int = 0, timeout: float = 1.0):
+        """
+        (seq, frame) for the newest frame if it is newer than after_seq (0: any frame);
+        frame is None if none arrived within timeout.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq != after_seq or not self._running, timeout)
+            if self._seq == after_seq:
+                return after_seq, None
+            return self._seq, self._frame
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join()
 
 
 def single_camera_worker(shared_state: dict, cam_id: str):
@@ -91,6 +318,15 @@ def single_camera_worker(shared_state: dict, cam_id: str):
     
     cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, 3) # Default Auto
 
+    # JPEG scratch buffer reused by the server for this camera's images
+    cam_config.setdefault('_encode_buf', bytearray(1 << 20))
+    cam_config.setdefault('_encode_lock', threading.Lock())
+    cam_config.setdefault('frame_cond', threading.Condition())
+
+    # Reads frames (and publishes the preview) on its own thread from here on
+    grabber = FrameGrabber(cap, on_frame=lambda frame: set_latest_frame(cam_config, True, frame))
+    seq = 0
+
     fusion_engine = ExposureFusionEngine()
     BRACKET_SETTINGS = [5000, 1000, 20]
     # for test
@@ -102,35 +338,35 @@ def single_camera_worker(shared_state: dict, cam_id: str):
         # --- COMMAND: REQUEST FUSION ---
         # คำสั่งนี้จะถูกส่งมาจาก Server (เมื่อกดปุ่มบนเว็บ)
         if cam_config['fusion_state'] == 'REQUESTED':
-            cam_config['fusion_state'] = 'PROCESSING'
+            set_fusion_state(shared_state['camera'], cam_id, 'PROCESSING')
             print(f"[Camera {cam_id}] Processing Fusion...")
             
             captured_frames = []
             
             # 1. Start Bracketing (Manual Exposure)
-            cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1)            
+            seq = grabber.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1)
             
             # Get initial brightness
-            ret, _frame = cap.read()
-            last_mean = np.mean(_frame) if ret else 0
+            seq, _frame = grabber.read(seq)
+            last_mean = _frame_brightness(_frame) if _frame is not None else 0
             
             for ev in BRACKET_SETTINGS:
-                cap.set(cv2.CAP_PROP_EXPOSURE, ev)
+                seq = grabber.set(cv2.CAP_PROP_EXPOSURE, ev)
                 
                 # Smart Wait (รอแสงนิ่ง)
                 start_t = time.time()
                 has_changed = False
                 stable_count = 0
                 prev_b = 0
+                last_frame = None
                 
                 while (time.time() - start_t) < 2.0:
-                    ret, frame = cap.read()
-                    if not ret: break
+                    # The grabber has already published this frame as the web preview
+                    seq, frame = grabber.read(seq)
+                    if frame is None: break
+                    last_frame = frame
                     
-                    # Update Preview for Web
-                    cam_config['latest_frame_data'] = (ret, frame)
-                    
-                    curr_b = np.mean(frame)
+                    curr_b = _frame_brightness(frame)
                     
                     # Check Change (>15%)
                     if not has_changed:
@@ -146,30 +382,32 @@ def single_camera_worker(shared_state: dict, cam_id: str):
                     
                     prev_b = curr_b
 
-                if cam_config['latest_frame_data'][1] is not None:
-                    captured_frames.append(cam_config['latest_frame_data'][1])
-                    last_mean = np.mean(cam_config['latest_frame_data'][1])
+                # The last frame read is the bracket's capture; its brightness is already known
+                if last_frame is not None:
+                    captured_frames.append(last_frame)
+                    last_mean = curr_b
 
             # 2. Compute Fusion
             if captured_frames:
                 result = fusion_engine.fuse(captured_frames)
                 cam_config['fused_result'] = result
+                cam_config['fused_result_id'] = cam_config.get('fused_result_id', 0) + 1
             
             # 3. Restore Auto Exposure
-            cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, 3)
-            cap.read() # flush
+            seq = grabber.set(cv2.CAP_PROP_AUTO_EXPOSURE, 3)
             
-            cam_config['fusion_state'] = 'READY'
+            set_fusion_state(shared_state['camera'], cam_id, 'READY')
+            wake = shared_state.get('wake_event')
+            if wake is not None:
+                wake.set()  # io_func waits on this for all cameras to be READY
             print(f"[Camera {cam_id}] Fusion Done.")
 
         # --- NORMAL LOOP ---
+        # The grabber publishes the preview; wake once per frame to check for requests
         else:
-            ret, frame = cap.read()
-            if ret:
-                cam_config['latest_frame_data'] = (ret, frame)
-            else:
-                time.sleep(0.1)
+            seq, _ = grabber.read(seq, timeout=0.1)
     
+    grabber.stop()
     cap.release()
     print(f"[Camera {cam_id}] Stopped.")
 
@@ -1,61 +1,299 @@
 # server.py
 from __future__ import annotations
-from typing import Any
-import io
+from typing import Any, Dict, Optional, Tuple
+import re
+import threading
+import time
 
 import numpy as np
 import cv2
-from flask import Flask, request, jsonify, abort, Response, send_file, render_template_string
+from flask import Flask, request, jsonify, abort, Response
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_422, TJFLAG_PROGRESSIVE
+    _turbo_jpeg = TurboJPEG()
+except Exception:  # PyTurboJPEG or libturbojpeg missing -> fall back to cv2.imencode
+    _turbo_jpeg = None
+
+try:
+    import orjson
+except ImportError:  # fall back to sanitize_value + jsonify
+    orjson = None
 
 app = Flask(__name__)
+# Frame ids restart from 0 with the process; keep ETags from a previous run from matching
+_ETAG_PREFIX = format(int(time.time()), "x")
+
+
+# Leaves are returned inline by the container walkers, saving a call per scalar
+_SCALAR_TYPES = frozenset({bool, int, float, str, type(None)})
+
+
+def _sanitize_identity(value: Any) -> Any:
+    return value
+
+
+def _sanitize_list(value: Any) -> Any:
+    return [v if type(v) in _SCALAR_TYPES else sanitize_value(v) for v in value]
+
+
+def _sanitize_dict(value: Any) -> Any:
+    return {
+        str(k): (v if type(v) in _SCALAR_TYPES else sanitize_value(v))
+        for k, v in value.items()
+    }
+
+
+# Exact-type handlers: one dict probe instead of an isinstance chain per node
+_SANITIZE_DISPATCH = {
+    bool: _sanitize_identity,
+    int: _sanitize_identity,
+    float: _sanitize_identity,
+    str: _sanitize_identity,
+    type(None): _sanitize_identity,
+    list: _sanitize_list,
+    tuple: _sanitize_list,
+    dict: _sanitize_dict,
+}
 
 
 def sanitize_value(value: Any) -> Any:
     """
     Convert value to JSON-safe structure.
     """
+    fn = _SANITIZE_DISPATCH.get(type(value))
+    if fn is not None:
+        return fn(value)
+    return _sanitize_value_slow(value)
+
+
+def _sanitize_value_slow(value: Any) -> Any:
+    """
+    isinstance-based fallback for subclasses and unknown types.
+    """
     simple_types = (bool, int, float, str, type(None))
 
     if isinstance(value, simple_types):
         return value
 
     if isinstance(value, (list, tuple)):
-        return [sanitize_value(v) for v in value]
+        return _sanitize_list(value)
 
     if isinstance(value, dict):
-        return {str(k): sanitize_value(v) for k, v in value.items()}
+        return _sanitize_dict(value)
 
     return str(type(value))
 
 
+def _orjson_default(value: Any) -> Any:
+    """
+    Called by orjson for types it doesn't serialize itself (and, with the passthrough
+    options, datetimes and dataclasses); gives what sanitize_value + jsonify would.
+    """
+    if isinstance(value, float):
+        return float(value)  # e.g. np.float64, which json encodes as a plain float
+    return sanitize_value(value)
+
+
+# Same key order as jsonify (sort_keys); datetimes/dataclasses go through sanitize_value
+_ORJSON_OPTIONS = (
+    orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE
+    | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+) if orjson is not None else 0
+
+
+# (id(root), path, sep) -> (root, container holding the last part, last part).
+# root is kept to pin its id: a freed root's id can be reused by a new object.
+_PATH_CACHE: Dict[Tuple[int, str, str], Tuple[Any, Any, str]] = {}
+_PATH_CACHE_MAXSIZE = 1024
+
+
+def clear_path_cache() -> None:
+    """
+    Forget memoized traversals; needed when a dict/list inside the state is replaced.
+    """
+    _PATH_CACHE.clear()
+
+
+def _step(node: Any, part: str) -> Any:
+    if type(node) is dict:
+        # Every container in shared_state is a plain dict: one lookup, no isinstance
+        try:
+            return node[part]
+        except KeyError:
+            abort(404, description=f"Key '{part}' not found in dict.")
+    if isinstance(node, dict):
+        if part not in node:
+            abort(404, description=f"Key '{part}' not found in dict.")
+        return node[part]
+    if isinstance(node, (list, tuple)):
+        try:
+            idx = int(part)
+        except ValueError:
+            abort(404, description=f"Index '{part}' is not a valid integer.")
+        try:
+            return node[idx]
+        except IndexError:
+            abort(404, description=f"Index {idx} out of range.")
+    abort(404, description=f"Cannot go deeper at '{part}'.")
+
+
 def resolve_path(root: Any, path: str, sep: str = "/") -> Any:
     """
     Traverse path like "camera/0/setting/CAP_PROP_FRAME_WIDTH"
+
+    The container holding the last part is memoized, so a repeated path costs one
+    dict probe plus the final lookup. The leaf itself is always read fresh.
     """
     if not path:
         return root
 
+    cache_key = (id(root), path, sep)
+    cached = _PATH_CACHE.get(cache_key)
+    if cached is not None and cached[0] is root:
+        return _step(cached[1], cached[2])
+
     parts = [p for p in path.split(sep) if p != ""]
-    node = root
-
-    for part in parts:
-        if isinstance(node, dict):
-            if part not in node:
-                abort(404, description=f"Key '{part}' not found in dict.")
-            node = node[part]
-        elif isinstance(node, (list, tuple)):
-            try:
-                idx = int(part)
-            except ValueError:
-                abort(404, description=f"Index '{part}' is not a valid integer.")
-            try:
-                node = node[idx]
-            except IndexError:
-                abort(404, description=f"Index {idx} out of range.")
-        else:
-            abort(404, description=f"Cannot go deeper at '{part}'.")
+    if not parts:
+        return root
+
+    parent = root
+    for part in parts[:-1]:
+        parent = _step(parent, part)
+
+    # Tuples (e.g. latest_frame_data) are replaced rather than mutated, so only
+    # mutable containers can be remembered safely.
+    if type(parent) in (dict, list):
+        if len(_PATH_CACHE) >= _PATH_CACHE_MAXSIZE:
+            _PATH_CACHE.clear()
+        _PATH_CACHE[cache_key] = (root, parent, parts[-1])
+
+    return _step(parent, parts[-1])
+
 
-    return node
+# Per cameras dict: how many cameras are in each fusion_state, kept current by
+# set_fusion_state so "are all cameras READY?" is one lookup instead of a scan.
+# id(cameras) -> (cameras, {state: count}); the dict is kept to pin its id.
+_FUSION_COUNTS: Dict[int, Tuple[dict, Dict[str, int]]] = {}
+_FUSION_LOCK = threading.Lock()
+
+
+def _fusion_counts(cameras: dict) -> Dict[str, int]:
+    """Caller holds _FUSION_LOCK."""
+    entry = _FUSION_COUNTS.get(id(cameras))
+    if entry is None:
+        counts: Dict[str, int] = {}
+        for cam in cameras.values():
+            state = cam.get("fusion_state")
+            counts[state] = counts.get(state, 0) + 1
+        entry = _FUSION_COUNTS[id(cameras)] = (cameras, counts)
+    return entry[1]
+
+
+def reset_fusion_counts() -> None:
+    """
+    Recount on next use; needed when a camera is added or replaced, or when
+    fusion_state is written without set_fusion_state.
+    """
+    with _FUSION_LOCK:
+        _FUSION_COUNTS.clear()
+
+
+def set_fusion_state(cameras: dict, cam_id: str, state: str) -> None:
+    """
+    cameras[cam_id]['fusion_state'] = state, keeping the per-state counts in step.
+    States: IDLE, REQUESTED, PROCESSING, READY
+    """
+    with _FUSION_LOCK:
+        counts = _fusion_counts(cameras)
+        cam = cameras[cam_id]
+        old = cam.get("fusion_state")
+        cam["fusion_state"] = state
+        if counts.get(old, 0) > 0:
+            counts[old] -= 1
+            counts[state] = counts.get(state, 0) + 1
+        else:  # written behind our back: recount on next use
+            del _FUSION_COUNTS[id(cameras)]
+
+
+def all_fusion_states(cameras: dict, state: str) -> bool:
+    """True if every camera's fusion_state is `state`."""
+    with _FUSION_LOCK:
+        return _fusion_counts(cameras).get(state, 0) == len(cameras)
+
+
+_INDEX_HTML = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="utf-8">
+    <title>Camera Control</title>
+    <style>
+        body { font-family: sans-serif; margin: 20px; background: #111; color: #eee; }
+        button { cursor: pointer; padding: 8px 16px; background: #007bff; color: white; border: none; border-radius: 4px; font-size: 14px; }
+        button:hover { background: #0056b3; }
+        button.all-btn { background: #28a745; font-size: 16px; margin-bottom: 20px; }
+        button.all-btn:hover { background: #1e7e34; }
+        .camera-grid { display: flex; flex-wrap: wrap; gap: 16px; }
+        .camera-card { border: 1px solid #444; border-radius: 8px; padding: 10px; background: #1e1e1e; }
+        .camera-card img { max-width: 480px; height: auto; display: block; background: #000; margin-top: 10px; }
+        .controls { margin-top: 10px; display: flex; gap: 10px; }
+    </style>
+    <script>
+        function setApi(k, v) {
+            fetch(`/api/set?k=${k}&v=${v}`)
+            .then(r => r.json())
+            .then(d => {
+                if(d.success) console.log("Set OK:", k, v);
+                else alert("Error setting value");
+            })
+            .catch(e => console.error(e));
+        }
+
+        function captureAll(ids) {
+            ids.forEach(id => {
+                setApi(`camera/${id}/fusion_state`, 'REQUESTED');
+            });
+        }
+
+        function reconnect(img) {
+            img.src = `${img.dataset.src}&t=${Date.now()}`;
+        }
+
+        // The server ends each /api/stream after {{ stream_seconds }} s so it cannot hold
+        // a worker forever; reopen the streams on that schedule, and retry on errors.
+        setInterval(() => {
+            document.querySelectorAll('img[data-src]').forEach(reconnect);
+        }, {{ stream_seconds * 1000 }});
+    </script>
+</head>
+<body>
+    <h1>Camera Dashboard</h1>
+
+    <button class="all-btn" onclick='captureAll({{ camera_ids | tojson }})'>CAPTURE ALL CAMERAS</button>
+
+    <div class="camera-grid">
+        {% for cid in camera_ids %}
+        <div class="camera-card">
+            <h2>Camera {{ cid }}</h2>
+            <div class="controls">
+                <button onclick="setApi('camera/{{ cid }}/fusion_state', 'REQUESTED')">Capture Fusion</button>
+                <a href="/api/get_image?id={{ cid }}&im=fused_result" target="_blank">
+                    <button style="background:#6c757d;">Get Fused Result</button>
+                </a>
+            </div>
+            <img src="/api/stream?id={{ cid }}" data-src="/api/stream?id={{ cid }}"
+                 onerror="setTimeout(() => reconnect(this), 1000)" alt="Preview">
+        </div>
+        {% endfor %}
+    </div>
+</body>
+</html>
+"""
+
+# Compiled once; render_template_string would re-lex/parse/compile it on every request.
+# app.jinja_env provides the tojson filter and autoescaping used by the page.
+_INDEX_TEMPLATE = app.jinja_env.from_string(_INDEX_HTML)
 
 
 @app.route("/")
@@ -74,78 +312,22 @@ def index():
 
     camera_ids = sorted(cameras.keys(), key=_to_int)
 
-    html_template = """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="utf-8">
-        <title>Camera Control</title>
-        <style>
-            body { font-family: sans-serif; margin: 20px; background: #111; color: #eee; }
-            button { cursor: pointer; padding: 8px 16px; background: #007bff; color: white; border: none; border-radius: 4px; font-size: 14px; }
-            button:hover { background: #0056b3; }
-            button.all-btn { background: #28a745; font-size: 16px; margin-bottom: 20px; }
-            button.all-btn:hover { background: #1e7e34; }
-            .camera-grid { display: flex; flex-wrap: wrap; gap: 16px; }
-            .camera-card { border: 1px solid #444; border-radius: 8px; padding: 10px; background: #1e1e1e; }
-            .camera-card img { max-width: 480px; height: auto; display: block; background: #000; margin-top: 10px; }
-            .controls { margin-top: 10px; display: flex; gap: 10px; }
-        </style>
-        <script>
-            function setApi(k, v) {
-                fetch(`/api/set?k=${k}&v=${v}`)
-                .then(r => r.json())
-                .then(d => {
-                    if(d.success) console.log("Set OK:", k, v);
-                    else alert("Error setting value");
-                })
-                .catch(e => console.error(e));
-            }
-
-            function captureAll(ids) {
-                ids.forEach(id => {
-                    setApi(`camera/${id}/fusion_state`, 'REQUESTED');
-                });
-            }
-        </script>
-    </head>
-    <body>
-        <h1>Camera Dashboard</h1>
-
-        <button class="all-btn" onclick='captureAll({{ camera_ids | tojson }})'>CAPTURE ALL CAMERAS</button>
-
-        <div class="camera-grid">
-            {% for cid in camera_ids %}
-            <div class="camera-card">
-                <h2>Camera {{ cid }}</h2>
-                <div class="controls">
-                    <button onclick="setApi('camera/{{ cid }}/fusion_state', 'REQUESTED')">Capture Fusion</button>
-                    <a href="/api/get_image?id={{ cid }}&im=fused_result" target="_blank">
-                        <button style="background:#6c757d;">Get Fused Result</button>
-                    </a>
-                </div>
-                <img src="/api/get_image?id={{ cid }}&im=latest_frame" alt="Preview">
-            </div>
-            {% endfor %}
-        </div>
-    </body>
-    </html>
-    """
-    return render_template_string(html_template, camera_ids=camera_ids)
+    return _INDEX_TEMPLATE.render(camera_ids=camera_ids, stream_seconds=_STREAM_MAX_SECONDS)
+
+
+_BOOL_LITERALS = {'true': True, 'false': False}
+_INT_RE = re.compile(r'[+-]?\d+')
+_FLOAT_RE = re.compile(r'[+-]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?')
 
 
 def _parse_value(v: str) -> Any:
     """Helper to guess type from string value"""
-    if v.lower() == 'true': return True
-    if v.lower() == 'false': return False
-    try:
-        return int(v)
-    except ValueError:
-        pass
-    try:
-        return float(v)
-    except ValueError:
-        pass
+    b = _BOOL_LITERALS.get(v.lower())
+    if b is not None: return b
+    s = v.strip()
+    # Classify with regexes so plain strings don't cost two raised ValueErrors
+    if _INT_RE.fullmatch(s): return int(s)
+    if _FLOAT_RE.fullmatch(s): return float(s)
     return v
 
 
@@ -179,9 +361,19 @@ def set_data():
         if parent_path:
             parent = resolve_path(shared_state, parent_path, sep)
         if isinstance(parent, dict):
-            parent[target_key] = val
+            # A new key or a replaced container changes the tree's shape
+            if target_key not in parent or isinstance(parent[target_key], (dict, list)):
+                clear_path_cache()
+                reset_fusion_counts()
+            if len(parts) == 3 and parts[0] == "camera" and target_key == "fusion_state":
+                set_fusion_state(shared_state["camera"], parts[1], val)
+            else:
+                parent[target_key] = val
         elif isinstance(parent, list):
             idx = int(target_key)
+            if isinstance(parent[idx], (dict, list)):
+                clear_path_cache()
+                reset_fusion_counts()
             parent[idx] = val
         else:
             abort(400, description="Target parent is not a dict or list.")
@@ -206,6 +398,15 @@ def get_data():
     sep = request.args.get("sep", "/")
     try:
         value = resolve_path(shared_state, v, sep=sep)
+        if orjson is not None:
+            try:
+                body = orjson.dumps(value, default=_orjson_default, option=_ORJSON_OPTIONS)
+            except orjson.JSONEncodeError:
+                body = None  # e.g. non-str keys (str(k) below) or ints wider than 64 bit
+            # Non-finite floats come out as null here (jsonify's NaN/Infinity isn't
+            # valid JSON; the dashboard's r.json() couldn't parse it anyway).
+            if body is not None:
+                return Response(body, mimetype="application/json")
         sanitized = sanitize_value(value)
         return jsonify(sanitized)
     except Exception as e:
@@ -220,27 +421,128 @@ def _get_camera_node(shared_state: dict, cam_id: str) -> dict:
     return cam
 
 
-def _extract_image_from_state(cam: dict, im_key: str) -> Any:
+def _frame_etag(cam: dict, quality: int, max_width: int) -> str:
+    return f"{_ETAG_PREFIX}-{cam.get('latest_frame_id', 0)}-q{quality}-w{max_width}"
+
+
+def _fit_width(img: np.ndarray, max_width: int) -> np.ndarray:
+    """
+    Shrink img to max_width (keeping aspect); 0 means full resolution.
+    """
+    h, w = img.shape[:2]
+    if max_width <= 0 or w <= max_width:
+        return img
+    return cv2.resize(img, (max_width, max(1, round(h * max_width / w))), interpolation=cv2.INTER_AREA)
+
+
+def _get_latest_frame_jpeg(cam: dict, quality: int = 85, max_width: int = 640) -> Any:
+    """
+    Return the encoded JPEG of the latest frame, encoding it at most once per frame id.
+    The preview is shown at <= 480px, so it is downscaled to max_width before encoding.
+    """
+    # Read the id before the frame: the producer writes the frame first, so the
+    # frame is never older than the id it gets cached under.
+    frame_id = cam.get("latest_frame_id", 0)
+    cached = cam.get("latest_frame_jpeg")
+    if cached is not None and cached[:3] == (frame_id, quality, max_width):
+        return cached[3]
+
+    latest = cam.get("latest_frame_data")
+    if not latest or len(latest) < 2 or latest[1] is None:
+        return None
+    jpeg = _encode_jpeg(_fit_width(latest[1], max_width), quality, cam)
+    cam["latest_frame_jpeg"] = (frame_id, quality, max_width, jpeg)
+    return jpeg
+
+
+def _get_fused_result_jpeg(cam: dict, quality: int = 85) -> Any:
+    """
+    Return fused_result as JPEG bytes, encoded (and copied out of the encoder) once
+    per 'fused_result_id' instead of on every request for the multi-MB image.
+    """
+    result_id = cam.get("fused_result_id", 0)
+    img = cam.get("fused_result")
+    if not isinstance(img, np.ndarray):
+        return img
+
+    # The identity check also catches writers that replace the array without bumping the id
+    cached = cam.get("fused_result_jpeg")
+    if cached is not None and cached[:2] == (result_id, quality) and cached[2] is img:
+        return cached[3]
+    jpeg = _encode_jpeg(img, quality, cam)
+    cam["fused_result_jpeg"] = (result_id, quality, img, jpeg)
+    return jpeg
+
+
+def _extract_image_from_state(cam: dict, im_key: str, quality: int = 85, max_width: int = 640) -> Any:
     if im_key == "fused_result":
-        return cam.get("fused_result")
+        return _get_fused_result_jpeg(cam, quality)
     if im_key == "latest_frame":
-        latest = cam.get("latest_frame_data")
-        if not latest or len(latest) < 2:
-            return None
-        return latest[1]
+        return _get_latest_frame_jpeg(cam, quality, max_width)
     abort(400)
 
 
-def _encode_image_to_response(img: Any, quality: int = 100) -> Response:
-    if isinstance(img, (bytes, bytearray, memoryview)):
-        return Response(bytes(img), mimetype="image/jpeg")
-
-    if isinstance(img, np.ndarray):
-        ok, buf = cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
-        if not ok: abort(500)
-        return Response(buf.tobytes(), mimetype="image/jpeg")
-
-    abort(500, description="Unknown image type")
+def _encode_jpeg(img: np.ndarray, quality: int, cam: dict) -> bytes:
+    if _turbo_jpeg is not None and img.dtype == np.uint8 and img.ndim == 3 and img.shape[2] == 3:
+        # Encode into the camera's scratch buffer (see single_camera_worker), which only
+        # grows, so steady-state requests don't allocate an output buffer.
+        lock = cam.get("_encode_lock")
+        if lock is None:
+            lock = cam.setdefault("_encode_lock", threading.Lock())
+        size = _turbo_jpeg.buffer_size(img, TJSAMP_422)
+        with lock:
+            buf = cam.get("_encode_buf")
+            if buf is None or len(buf) < size:
+                buf = cam["_encode_buf"] = bytearray(size)
+            _, n = _turbo_jpeg.encode(
+                np.ascontiguousarray(img), quality=int(quality), pixel_format=TJPF_BGR,
+                jpeg_subsample=TJSAMP_422, flags=TJFLAG_PROGRESSIVE, dst=buf,
+            )
+            return bytes(memoryview(buf)[:n])
+
+    # Flag values must be ints, not bools
+    params = [
+        int(cv2.IMWRITE_JPEG_QUALITY), int(quality),
+        int(cv2.IMWRITE_JPEG_OPTIMIZE), 1,
+        int(cv2.IMWRITE_JPEG_PROGRESSIVE), 1,
+    ]
+    ok, buf = cv2.imencode(".jpg", img, params)
+    if not ok: abort(500)
+    return buf.tobytes()
+
+
+def _set_revalidate_headers(resp: Response, etag: str) -> Response:
+    # Cacheable, but the browser must ask again (If-None-Match) before reusing it
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache, must-revalidate"
+    return resp
+
+
+def _encode_image_to_response(
+        img: Any, cam: dict, quality: int = 85, etag: Optional[str] = None
+) -> Response:
+    if isinstance(img, bytes):
+        data = img  # the cached JPEG itself; Response keeps a reference, no copy
+    elif isinstance(img, (bytearray, memoryview)):
+        data = bytes(img)
+    elif isinstance(img, np.ndarray):
+        data = _encode_jpeg(img, quality, cam)
+    else:
+        abort(500, description="Unknown image type")
+
+    resp = Response(data, mimetype="image/jpeg")
+    if etag:
+        _set_revalidate_headers(resp, etag)
+    # Range / If-None-Match handling without send_file: it wraps the body in a
+    # BytesIO and calls getbuffer(), which copies the whole JPEG per request.
+    return resp.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+
+def _image_args() -> Tuple[int, int]:
+    """(quality, max_width) from ?q= (1..100, default 85) and ?w= (0 = full size, default 640)."""
+    quality = min(max(request.args.get("q", 85, type=int), 1), 100)
+    max_width = max(request.args.get("w", 640, type=int), 0)
+    return quality, max_width
 
 
 @app.route("/api/get_image", methods=["GET"])
@@ -251,16 +553,105 @@ def get_image():
     cam_id = request.args.get("id", "0")
     im_key = request.args.get("im")
     if not im_key: abort(400)
+    quality, max_width = _image_args()  # max_width: latest_frame only
 
     cam = _get_camera_node(shared_state, cam_id)
-    img = _extract_image_from_state(cam, im_key)
+
+    etag = None
+    if im_key == "latest_frame":
+        etag = _frame_etag(cam, quality, max_width)
+        if request.if_none_match.contains(etag):
+            return _set_revalidate_headers(Response(status=304), etag)
+
+    img = _extract_image_from_state(cam, im_key, quality, max_width)
     if img is None: abort(404)
 
-    return _encode_image_to_response(img)
+    return _encode_image_to_response(img, cam, quality, etag)
+
+
+# Seconds without a new frame before /api/stream re-sends the last one (or ends)
+_STREAM_IDLE_TIMEOUT = 5.0
+# Lifetime of one /api/stream response; the dashboard reconnects on the same period
+_STREAM_MAX_SECONDS = 600
+
+
+def _mjpeg_generator(shared_state: dict, cam: dict, quality: int, max_width: int):
+    """
+    Yield multipart JPEG parts, one per new frame id. Frames come from the same
+    encoded-JPEG cache as /api/get_image, so nothing is encoded twice.
+
+    A closed client is only noticed when a write fails, so when no frame arrives
+    for _STREAM_IDLE_TIMEOUT (camera stopped or never opened) the last part is
+    re-sent, or the stream ends if there never was one. Otherwise the request
+    would hold a server worker forever. Live streams end after _STREAM_MAX_SECONDS
+    too, so a page left open does not pin a worker for good.
+    """
+    cond = cam.get("frame_cond")
+    last_id = None
+    jpeg = None
+    idle_since = time.monotonic()
+    deadline = idle_since + _STREAM_MAX_SECONDS
+    while (shared_state.get("is_running", True) and cam.get("is_running", True)
+           and time.monotonic() < deadline):
+        frame_id = cam.get("latest_frame_id", 0)
+        if frame_id == last_id:
+            remaining = _STREAM_IDLE_TIMEOUT - (time.monotonic() - idle_since)
+            if remaining > 0:
+                if cond is None:
+                    time.sleep(0.05)
+                else:
+                    with cond:
+                        cond.wait_for(lambda: cam.get("latest_frame_id", 0) != last_id,
+                                      timeout=min(remaining, 1.0))
+                continue
+            if jpeg is None:
+                return
+        else:
+            last_id = frame_id
+            new_jpeg = _get_latest_frame_jpeg(cam, quality, max_width)
+            if new_jpeg is None:
+                continue
+            jpeg = new_jpeg
+
+        idle_since = time.monotonic()
+        yield b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(jpeg)
+        yield jpeg
+        yield b"\r\n"
+
+
+@app.route("/api/stream", methods=["GET"])
+def stream():
+    """
+    Usage: /api/stream?id=0[&q=85][&w=640] (MJPEG of latest_frame, for <img src=...>)
+    """
+    shared_state = app.config.get("shared_state")
+    if shared_state is None: abort(500)
+
+    cam = _get_camera_node(shared_state, request.args.get("id", "0"))
+    quality, max_width = _image_args()
+
+    resp = Response(
+        _mjpeg_generator(shared_state, cam, quality, max_width),
+        mimetype="multipart/x-mixed-replace; boundary=frame",
+    )
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
 
 
 def run_server(shared_state: dict) -> None:
     app.config["shared_state"] = shared_state
     host = shared_state.get('ipv4', '0.0.0.0')
     port = shared_state.get('port', 5000)
-    app.run(host=host, port=port, debug=False, threaded=True, use_reloader=False)
\ No newline at end of file
+    try:
+        from waitress import serve
+    except ImportError:
+        app.run(host=host, port=port, debug=False, threaded=True, use_reloader=False)
+        return
+    # Fixed worker pool instead of a thread per request. Every open /api/stream
+    # holds a worker for up to _STREAM_MAX_SECONDS, and one dashboard tab opens a
+    # stream per camera: with C cameras, V open tabs need C * V workers, plus a few
+    # for the REST calls. Requests beyond the pool queue until a stream ends.
+    # The default fits four tabs; set server_threads for more viewers.
+    cameras = shared_state.get('camera') or {}
+    threads = int(shared_state.get('server_threads', max(16, 4 * len(cameras) + 8)))
+    serve(app, host=host, port=port, threads=threads, _quiet=True)
\ No newline at end of file
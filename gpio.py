@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 from typing import List, Optional, Callable, Dict, Tuple, Any, Union
+import functools
+import heapq
 import time
 import threading
 import gpiozero
@@ -42,15 +44,28 @@ class DigitalOutputDevice(gpiozero.DigitalOutputDevice):
 class Inputs:
     def __init__(self, poll_interval: float = 0.05):
         self.inputs: List[DigitalInputDevice] = []
-        self.poll_interval = poll_interval
+        self._by_pin: Dict[int, DigitalInputDevice] = {}
+        self._by_name: Dict[str, DigitalInputDevice] = {}
+        self.poll_interval = poll_interval  # kept for API compatibility; run() no longer polls
         self._running = False
+        self._stop_event = threading.Event()
 
-        self._edge_callbacks: List[Callable[[DigitalInputDevice, int], None]] = []
+        # Registered rarely, read on every edge: immutable tuples replaced on
+        # registration (copy-on-write), so the edge path iterates them without locking.
+        self._edge_callbacks: Tuple[Callable[[DigitalInputDevice, int], None], ...] = ()
         self._handlers_attached: bool = False
 
-        self._simul_groups: List[Dict[str, Any]] = []
+        self._simul_groups: Tuple[Dict[str, Any], ...] = ()
         self._lock = threading.Lock()
 
+        # One scheduler thread flushes all windows: heap of (deadline, seq, group, events).
+        # Each entry carries its window's own event list, so a flush that runs late
+        # (a callback blocked the scheduler) still delivers that window's events.
+        self._pending: List[Tuple[float, int, Dict[str, Any], List[Tuple[str, int]]]] = []
+        self._pending_seq = 0
+        self._sched_cv = threading.Condition()
+        self._scheduler: Optional[threading.Thread] = None
+
     def add(
             self,
             pin: int,
@@ -70,29 +85,28 @@ class Inputs:
             pin_factory=pin_factory,
         )
         self.inputs.append(device)
+        # setdefault: the first device added keeps the key, as with a linear scan
+        self._by_pin.setdefault(device.pin.number, device)
+        self._by_name.setdefault(device.name, device)
         return device
 
     def get(self, key: Union[int, str]) -> DigitalInputDevice:
         """
         Find a device by Pin Number (int) or Name (str).
         """
-        for device in self.inputs:
-            if isinstance(key, int):
-                # Compare with the integer number of the pin
-                if device.pin.number == key:
-                    return device
-            elif isinstance(key, str):
-                if device.name == key:
-                    return device
-
-        raise ValueError(f"Input Device not found: {key}")
+        index = self._by_pin if isinstance(key, int) else self._by_name
+        try:
+            return index[key]
+        except (KeyError, TypeError):
+            raise ValueError(f"Input Device not found: {key}") from None
 
     def _attach_handlers_once(self):
         if self._handlers_attached:
             return
         for device in self.inputs:
-            device.when_activated = lambda d=device: self._handle_edge(d, 1)
-            device.when_deactivated = lambda d=device: self._handle_edge(d, 0)
+            # partial objects are called from C, without an extra lambda frame per edge
+            device.when_activated = functools.partial(self._handle_edge, device, 1)
+            device.when_deactivated = functools.partial(self._handle_edge, device, 0)
 
         self._handlers_attached = True
 
@@ -101,7 +115,8 @@ class Inputs:
         Register a callback called on every edge:
             callback(device, value)
         """
-        self._edge_callbacks.append(callback)
+        with self._lock:
+            self._edge_callbacks = self._edge_callbacks + (callback,)
         self._attach_handlers_once()
 
     def simultaneous_events(
@@ -130,68 +145,99 @@ class Inputs:
                 "callback": callback,
                 "events": [],
                 "window_start": None,  # type: Optional[float]
-                "window_id": 0,  # type: int
+                "lock": threading.Lock(),  # guards this group's window state only
             }
-            self._simul_groups.append(group)
+            self._simul_groups = self._simul_groups + (group,)
 
     def _handle_edge(self, device: DigitalInputDevice, value: int):
         for cb in self._edge_callbacks:
             cb(device, value)
         self._handle_simultaneous_edge(device, value)
+        if self._running:
+            self._print_states()
 
     def _handle_simultaneous_edge(self, device: DigitalInputDevice, value: int):
         now = time.monotonic()
-        with self._lock:
-            if not self._simul_groups:
-                return
-
-            for group in self._simul_groups:
-                duration: float = group["duration"]
-                if duration <= 0:
-                    continue
+        # No self._lock here: the groups tuple is never mutated, and each group
+        # only takes its own lock, so edges for different groups don't serialize.
+        for group in self._simul_groups:
+            duration: float = group["duration"]
+            if duration <= 0:
+                continue
+            with group["lock"]:
                 window_start: Optional[float] = group["window_start"]
                 if window_start is None or (now - window_start) > duration:
+                    # A fresh list: the previous window's list stays with its heap entry
                     group["window_start"] = now
                     group["events"] = []
-                    group["window_id"] += 1
-                    window_id = group["window_id"]
-                    timer = threading.Timer(
-                        duration,
-                        self._flush_simultaneous_events_group,
-                        args=(group, window_id),
-                    )
-                    timer.daemon = True
-                    timer.start()
+                    self._schedule_flush(now + duration, group, group["events"])
 
                 group["events"].append((device.name, value))
 
-    def _flush_simultaneous_events_group(self, group: Dict[str, Any], window_id: int):
-        with self._lock:
-            if window_id != group["window_id"]:
-                return
-
-            events: List[Tuple[str, int]] = group["events"]
-            if not events:
+    def _schedule_flush(
+            self,
+            deadline: float,
+            group: Dict[str, Any],
+            events: List[Tuple[str, int]]
+    ) -> None:
+        with self._sched_cv:
+            self._pending_seq += 1  # tie-breaker: groups (dicts) are not orderable
+            heapq.heappush(self._pending, (deadline, self._pending_seq, group, events))
+            if self._scheduler is None:
+                self._scheduler = threading.Thread(target=self._sched_loop, daemon=True)
+                self._scheduler.start()
+            self._sched_cv.notify()
+
+    def _sched_loop(self) -> None:
+        """
+        Sleep until the earliest window deadline, then flush it. Group callbacks
+        run on this thread, so long work inside them delays other windows (they
+        are still delivered, in deadline order, once the callback returns).
+        """
+        while True:
+            with self._sched_cv:
+                while True:
+                    if self._stop_event.is_set():
+                        return
+                    if not self._pending:
+                        self._sched_cv.wait()
+                        continue
+                    delay = self._pending[0][0] - time.monotonic()
+                    if delay <= 0:
+                        _, _, group, events = heapq.heappop(self._pending)
+                        break
+                    self._sched_cv.wait(delay)
+            self._flush_simultaneous_events_group(group, events)
+
+    def _flush_simultaneous_events_group(self, group: Dict[str, Any], events: List[Tuple[str, int]]):
+        with group["lock"]:
+            # Still the open window: close it so no later edge appends to this list.
+            # Otherwise a newer window has replaced it already and only delivery is left.
+            if group["events"] is events:
+                group["events"] = []
                 group["window_start"] = None
+            if not events:
                 return
-
-            # copy + reset
-            events_to_send = list(events)
-            group["events"] = []
-            group["window_start"] = None
             cb = group["callback"]
 
         if cb:
-            cb(events_to_send)
+            cb(events)
+
+    def _print_states(self) -> None:
+        states = " | ".join(str(device) for device in self.inputs)
+        print(f"\r{states}", end="", flush=True)  # Print on same line
 
     def run(self):
+        """
+        Block until stop() (or Ctrl+C). The status line is reprinted from the edge
+        handlers, so nothing runs while the inputs are idle.
+        """
         print("Starting input monitor...  (Ctrl+C to stop)")
+        self._attach_handlers_once()
         self._running = True
+        self._print_states()
         try:
-            while self._running:
-                states = " | ".join(str(device) for device in self.inputs)
-                print(f"\r{states}", end="", flush=True)  # Print on same line
-                time.sleep(self.poll_interval)
+            self._stop_event.wait()
         except KeyboardInterrupt:
             print("\nStopping...")
         finally:
@@ -199,6 +245,9 @@ class Inputs:
 
     def stop(self) -> None:
         self._running = False
+        self._stop_event.set()
+        with self._sched_cv:
+            self._sched_cv.notify()
         for device in self.inputs:
             device.close()
         print("All Input GPIO pins closed.")
@@ -207,26 +256,25 @@ class Inputs:
 class Outputs:
     def __init__(self):
         self.outputs: List[DigitalOutputDevice] = []
+        self._by_pin: Dict[int, DigitalOutputDevice] = {}
+        self._by_name: Dict[str, DigitalOutputDevice] = {}
 
     def add(self, device: DigitalOutputDevice) -> DigitalOutputDevice:
         self.outputs.append(device)
+        # setdefault: the first device added keeps the key, as with a linear scan
+        self._by_pin.setdefault(device.pin.number, device)
+        self._by_name.setdefault(device.name, device)
         return device
 
     def get(self, key: Union[int, str]) -> DigitalOutputDevice:
         """
         Find a device by Pin Number (int) or Name (str).
         """
-        for device in self.outputs:
-            if isinstance(key, int):
-                # Check pin number
-                if device.pin.number == key:
-                    return device
-            elif isinstance(key, str):
-                # Check name
-                if device.name == key:
-                    return device
-
-        raise ValueError(f"Output Device not found: {key}")
+        index = self._by_pin if isinstance(key, int) else self._by_name
+        try:
+            return index[key]
+        except (KeyError, TypeError):
+            raise ValueError(f"Output Device not found: {key}") from None
 
     def close(self):
         for device in self.outputs:
@@ -1,47 +1,82 @@
 from typing import List, Optional, Callable, Dict, Tuple, Any
 import time
+import threading
 from pathlib import Path
 from datetime import datetime, timedelta
 from hexss import check_packages
-from hexss.image import Image
 from hexss.constants import *
 
 check_packages(
-   'numpy', 'opencv-python', 'Flask', 'requests', 'pygame', 'pygame-gui',
+   'numpy', 'opencv-python', 'Flask', 'requests', 'pygame', 'pygame-gui', 'numexpr',
    'tensorflow', 'keras', 'pyzbar', 'AutoInspection', 'matplotlib',
    'flatbuffers==23.5.26',
    auto_install=True
 )
 
+import numpy as np
 from hexss import json_load, close_port, system, username
 from hexss.protocol.raspberrypi import IOController
 from AutoInspection import AutoInspection, training
 from AutoInspection.server import run_server
+from capture_server import set_fusion_state, all_fusion_states
+
+# Position (x, y) of each camera's 1024x768 fused image on the 2048x1536 composite
+FUSED_TILES = {'0': (0, 0), '4': (1024, 0), '6': (0, 768), '2': (1024, 768)}
+TILE_W, TILE_H = 1024, 768
+CANVAS_SHAPE = (1536, 2048, 3)
+
+
+def stitch_fused_results(cameras: Dict[str, dict], out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Tile the cameras' fused results (BGR ndarrays, same process) onto a canvas.
+    Tiles are pasted at native size and clipped to the canvas, like Image.overlay;
+    a camera without a result leaves its tile grey.
+
+    out: canvas to reuse. Tiles fully covered by a result are just overwritten,
+    so only missing or undersized tiles are painted grey.
+    """
+    if out is None:
+        out = np.empty(CANVAS_SHAPE, np.uint8)
+    for cid, (x, y) in FUSED_TILES.items():
+        tile = out[y:y + TILE_H, x:x + TILE_W]
+        fused = cameras[cid]['fused_result'] if cid in cameras else None
+        if fused is None:
+            tile.fill(0x99)
+            continue
+        h = min(fused.shape[0], CANVAS_SHAPE[0] - y)
+        w = min(fused.shape[1], CANVAS_SHAPE[1] - x)
+        if h < tile.shape[0] or w < tile.shape[1]:
+            tile.fill(0x99)
+        out[y:y + h, x:x + w] = fused[:h, :w]
+    return out
 
             
 def io_func(data):
+    # Set by the reed switch and by camera workers reaching READY, so the main loop
+    # reacts at once instead of on its next 0.5 s tick
+    wake = data['shared_state'].setdefault('wake_event', threading.Event())
     
     def reset():
-        if not io.get('Area').value and not io.get('EM').value:
-            io.get('Switch Lamp').on()
-            io.get('Cylinder 1-').on()
-            io.get('Cylinder 2-').on()
+        if not area.value and not em.value:
+            lamp.on()
+            cyl1_pull.on()
+            cyl2_pull.on()
         data['step'] = '-'
 
     def on_lamp():
-        """if io.get('Proximity 1').value and io.get('Proximity 2').value and not io.get('Area').value and not io.get('EM').value:"""
-        if io.get('Proximity 2').value and not io.get('Area').value and not io.get('EM').value:
-            io.get('Switch Lamp').on()
+        """if prox1.value and prox2.value and not area.value and not em.value:"""
+        if prox2.value and not area.value and not em.value:
+            lamp.on()
             return True
         return False
     def cylinder_1_pull():
-        if not io.get('Area').value and not io.get('EM').value:
-            io.get('Cylinder 1-').on()
+        if not area.value and not em.value:
+            cyl1_pull.on()
             return True
         return False
     def cylinder_1_push():
-        if not io.get('Area').value and not io.get('EM').value:
-            io.get('Cylinder 1+').on()
+        if not area.value and not em.value:
+            cyl1_push.on()
             return True
         return False
     
@@ -49,20 +84,22 @@ def io_func(data):
     def on_change(device, value):
         # print(f"[LOG] {device.name} -> {value}")
         
+        if device.name == 'Cylinder 1 Reed Switch' and value == 1:
+            wake.set()
         if device.name == 'Cylinder 1+' and value == 1:
-            io.get('Cylinder 1-').off()
+            cyl1_pull.off()
         if device.name == 'Cylinder 1-' and value == 1:
-            io.get('Cylinder 1+').off()
+            cyl1_push.off()
         if device.name == 'Cylinder 2+' and value == 1:
-            io.get('Cylinder 2-').off()
+            cyl2_pull.off()
         if device.name == 'Cylinder 2-' and value == 1:
-            io.get('Cylinder 2+').off()
+            cyl2_push.off()
 
 
         if device.name in ['Proximity 1', 'Proximity 2']:
             if value == 0:
-                io.get('Switch Lamp').off()
-                if io.get('Proximity 1').value == 0 and io.get('Proximity 2').value == 0: # เอา part ออก
+                lamp.off()
+                if prox1.value == 0 and prox2.value == 0: # เอา part ออก
                     if data['step'] == 'WAIT_REMOVE_PART':
                         data['step'] = '-'
             if value == 1:    
@@ -71,20 +108,20 @@ def io_func(data):
 
         if device.name == 'Area':
             if value == 1:
-                io.get('Switch Lamp').off()
-                io.get('Cylinder 1+').off()
-                io.get('Cylinder 1-').off()
+                lamp.off()
+                cyl1_push.off()
+                cyl1_pull.off()
             if value == 0:
                 if data['step'] != 'WAIT_REMOVE_PART':
                     on_lamp()
             
         if device.name == 'EM':
             if value == 1:
-                io.get('Switch Lamp').off()
-                io.get('Cylinder 1-').off()
-                io.get('Cylinder 2-').off()
-                io.get('Cylinder 1+').off()
-                io.get('Cylinder 2+').off()
+                lamp.off()
+                cyl1_pull.off()
+                cyl2_pull.off()
+                cyl1_push.off()
+                cyl2_push.off()
             else:
                 reset()
             
@@ -92,33 +129,32 @@ def io_func(data):
     def handle_simultaneous(events: List[Tuple[str, int]]):
         # print("simultaneous (0.2s):", events)
         if ('Switch L', 1) in events and ('Switch R', 1) in events:
-            if io.get('EM').value or io.get('Area').value:
-                io.get('Buzzer').blink(0.1, 0.1, n=2)
+            if em.value or area.value:
+                buzzer.blink(0.1, 0.1, n=2)
                 return
-            if io.get('Proximity 1').value == 0 and io.get('Proximity 2').value == 0:
-                io.get('Cylinder 1-').on() #ถอยออก
-                io.get('Buzzer').blink(0.1, 0.1, n=2)
+            if prox1.value == 0 and prox2.value == 0:
+                cyl1_pull.on() #ถอยออก
+                buzzer.blink(0.1, 0.1, n=2)
                 return
             
             if data['status'].get('set_qty',0) <= data['status'].get('pass_n',0):
-                io.get('Buzzer').blink(0.1, 0.1, n=3)
+                buzzer.blink(0.1, 0.1, n=3)
                 return
-            """if io.get('Proximity 1').value and io.get('Proximity 2').value:"""
-            if io.get('Proximity 2').value:
+            """if prox1.value and prox2.value:"""
+            if prox2.value:
                 if  data['step'] == 'PUSH': # หลังจากกำลังเข้าไป แล้ว error
                     cylinder_1_push()
                 elif data['step'] == 'WAIT_REMOVE_PART': # หลังจากกำลังถอยออก แล้ว error
-                    io.get('Switch Lamp').off()
+                    lamp.off()
                     cylinder_1_pull()
                     
                 elif data['step'] != 'WAIT_REMOVE_PART':
-                    io.get('Switch Lamp').blink(on_time=0.2, off_time=0.2)
-                    io.get('Cylinder 1+').on()
+                    lamp.blink(on_time=0.2, off_time=0.2)
+                    cyl1_push.on()
 
-                    fusion_states = [v['fusion_state'] for v in data['shared_state']['camera'].values()]                    
                     # IDLE, REQUESTED, PROCESSING, READY
-                    if all(fusion_state == 'IDLE' for fusion_state in fusion_states):
-                        io.get('Switch Lamp').blink(on_time=0.2, off_time=0.2)
+                    if all_fusion_states(data['shared_state']['camera'], 'IDLE'):
+                        lamp.blink(on_time=0.2, off_time=0.2)
                         data['step'] = 'PUSH'
                     
     
@@ -141,6 +177,15 @@ def io_func(data):
     io.output.add(27, 'Cylinder 2-')
     io.output.add(23)
     io.output.add(25)
+
+    # Resolve devices once for the callbacks and the loop: IOController.get() scans
+    # the inputs, raises, then scans the outputs on every call.
+    em, area = io.get('EM'), io.get('Area')
+    prox1, prox2 = io.get('Proximity 1'), io.get('Proximity 2')
+    reed1 = io.get('Cylinder 1 Reed Switch')
+    lamp, buzzer = io.get('Switch Lamp'), io.get('Buzzer')
+    cyl1_push, cyl1_pull = io.get('Cylinder 1+'), io.get('Cylinder 1-')
+    cyl2_push, cyl2_pull = io.get('Cylinder 2+'), io.get('Cylinder 2-')
     
     io.on_change(on_change)
     io.simultaneous_events(handle_simultaneous, duration=0.2)
@@ -150,32 +195,29 @@ def io_func(data):
 
 
     while data.get('play'):
-        time.sleep(0.5)
+        wake.wait(timeout=0.5)
+        wake.clear()  # anything that set it is re-checked below
         
         if data['step'] == 'PUSH':
-            if io.get("Cylinder 1 Reed Switch").value == 1:
+            if reed1.value == 1:
                 data['step'] = '-'
-                for k, v in data['shared_state']['camera'].items():
-                    v['fusion_state'] = 'REQUESTED'
+                for k in data['shared_state']['camera']:
+                    set_fusion_state(data['shared_state']['camera'], k, 'REQUESTED')
             
         # IDLE, REQUESTED, PROCESSING, READY
-        fusion_states = [v['fusion_state'] for v in data['shared_state']['camera'].values()]
-        if all(fusion_state == 'READY' for fusion_state in fusion_states):
-            io.get('Switch Lamp').blink(on_time=0.1, off_time=0.1)
-            for k, v in data['shared_state']['camera'].items():
-                v['fusion_state'] = 'IDLE'
+        if all_fusion_states(data['shared_state']['camera'], 'READY'):
+            lamp.blink(on_time=0.1, off_time=0.1)
+            for k in data['shared_state']['camera']:
+                set_fusion_state(data['shared_state']['camera'], k, 'IDLE')
             
-            im = Image.new("RGB", (2048, 1536), "#999")
-            try: im.overlay(Image('http://127.0.0.1:3001/api/get_image?id=0&im=fused_result'), (0,0))
-            except: ...
-            try: im.overlay(Image('http://127.0.0.1:3001/api/get_image?id=4&im=fused_result'), (1024,0))
-            except: ...
-            try: im.overlay(Image('http://127.0.0.1:3001/api/get_image?id=6&im=fused_result'), (0,768))
-            except: ...
-            try: im.overlay(Image('http://127.0.0.1:3001/api/get_image?id=2&im=fused_result'), (1024,768))
-            except: ...
-
-            data['img_form_api'] = im.numpy()
+            # The camera workers run in this process: copy their results directly
+            # instead of fetching each one back through the capture server as a JPEG.
+            # Two canvases used in turn: the UI keeps the previous composite (np_img, for
+            # crops and saving) until it handles 'change_image', so don't overwrite it.
+            if data.get('_canvas') is None:
+                data['_canvas'] = [np.empty(CANVAS_SHAPE, np.uint8) for _ in range(2)]
+            canvas = next(c for c in data['_canvas'] if c is not data['img_form_api'])
+            data['img_form_api'] = stitch_fused_results(data['shared_state']['camera'], canvas)
 
             data['events'].append('change_image')
             data['events'].append('Predict')
@@ -188,34 +230,34 @@ def io_func(data):
             
             elif data['status']['res'] == 'OK':
                 data['step'] = 'WAIT_REMOVE_PART'
-                io.get('Buzzer').blink(0.1, 0.1, n=1)
-                io.get('Cylinder 2+').on()
+                buzzer.blink(0.1, 0.1, n=1)
+                cyl2_push.on()
                 time.sleep(0.5)
-                io.get('Cylinder 2-').on()
+                cyl2_pull.on()
                 time.sleep(0.1)
                 if data['status'].get('set_qty',0) == data['status'].get('pass_n',0):
-                    io.get('Buzzer').blink(0.1, 0.1, n=3)
+                    buzzer.blink(0.1, 0.1, n=3)
                 
-                if io.get('Area').value == 0 and io.get('EM').value == 0:
-                    io.get('Cylinder 1-').on()
-                    io.get('Switch Lamp').off()
+                if area.value == 0 and em.value == 0:
+                    cyl1_pull.on()
+                    lamp.off()
 
             
             elif data['status']['res'] == 'NG':
                 data['step'] = '-'
-                io.get('Buzzer').blink(on_time=0.2, off_time=0.3)
+                buzzer.blink(on_time=0.2, off_time=0.3)
                 data['events'].append('input_password')
                 data['status']['enter_password_to_reset'] = False # True, False, 'wait'
                 
 
         if data['status'].get('enter_password_to_reset') == True:
             data['status']['enter_password_to_reset'] = None   
-            io.get('Buzzer').off()
+            buzzer.off()
 
-            if not io.get('Area').value and not io.get('EM').value:
-                io.get('Cylinder 1-').on()
+            if not area.value and not em.value:
+                cyl1_pull.on()
                 data['step'] = 'WAIT_REMOVE_PART'
-                io.get('Switch Lamp').off()               
+                lamp.off()               
                 
 
 
@@ -310,6 +352,8 @@ if __name__ == '__main__':
     import capture_server
     import capture
     m.add_func(capture_server.run_server, args=(data['shared_state'],), join=False)
+    # Camera workers must share this process: io_func stitches their fused_result
+    # arrays straight out of shared_state (moving them out would need SharedMemory).
     for cam_id in data['shared_state']['camera']:
         m.add_func(capture.single_camera_worker, args=(data['shared_state'], cam_id), join=False)
     